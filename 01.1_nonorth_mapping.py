@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from pathlib import Path
 from collections import defaultdict
-import re
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import pickle
+import sys
 
 # Set the base directory with appropriate subfolder structure
 BASE_DIR = Path("/mnt/c/Users/Tuna/Desktop/test")  # Windows path
@@ -16,62 +23,139 @@ SPECIES_CONFIG = {
     "F_graminearum": {
         "taxid": "229533",                # STRING Taxonomy ID
         "prefix": "FGSG",                 # Gene ID prefix (e.g., FGSG_00001)
-        "file_pattern": "^[12]_"          # Regex to match filenames for this species
+        "file_prefixes": "12"             # Leading study digits for this species
     },
     "F_oxysporum": {
         "taxid": "426428",
         "prefix": "FOXG",
-        "file_pattern": "^[34578]_"
+        "file_prefixes": "34578"
     }
 }
 STRING_VERSION = "12.0"
 
+# Prefer the Rust-based calamine engine for XLSX parsing; openpyxl is the
+# pure-Python fallback when python-calamine is not installed
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 
 # Define the necessary functions
-## Load STRING allias
-def load_string_aliases(alias_file):
-    alias_map = {}
+## Load STRING allias, keeping only the wanted gene ID prefixes
+def load_string_aliases(alias_file, wanted_prefixes):
+    prefixes = sorted(p.upper() for p in wanted_prefixes)
+
+    # Reuse the pickle sidecar from a previous run if it is still fresh;
+    # the name carries the prefix set so different configs never collide
+    cache_file = alias_file.with_suffix(f".{'-'.join(prefixes)}.aliases.pkl")
+    if cache_file.exists() and cache_file.stat().st_mtime >= alias_file.stat().st_mtime:
+        print(f"Loading cached aliases from: {cache_file.name}...")
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+
     print(f"Loading aliases from: {alias_file.name}...")
-    
-    with open(alias_file, 'r') as f:
-        next(f)                           # Skip header
-        for line in f:
-            parts = line.strip().split('\t')
-            # Map alias (col 1) to Protein ID (col 0)
-            if len(parts) >= 2:
-                alias_map[parts[1]] = parts[0]
-                
-    return alias_map
-
-## Filter the complete allias data for specific gene ID prefixes
-def filter_gene_map(full_alias_map, prefix):
-    pattern = re.compile(f"^{prefix}_\\d+$", re.IGNORECASE)
-    return {k.upper(): v for k, v in full_alias_map.items() if pattern.match(k)}
+
+    # Parse with the pandas C engine instead of a per-line Python loop;
+    # STRING alias files carry no quoting, so skip quote handling too
+    df = pd.read_csv(alias_file, sep='\t', header=0, usecols=[0, 1],
+                     names=['string_id', 'alias'], dtype='string', engine='c',
+                     quoting=csv.QUOTE_NONE, memory_map=True)
+    df = df.dropna()                      # Drop malformed rows missing either column
+
+    # Filter while loading so the full alias dict is never materialized:
+    # cheap vectorized prefix gate, then the validating pattern, and the
+    # tiny surviving subset is bucketed per prefix
+    aliases = df['alias'].str.upper()
+    keep = aliases.str.startswith(tuple(f"{p}_" for p in prefixes))
+    df, aliases = df[keep], aliases[keep]
+    keep = aliases.str.match(f"^({'|'.join(prefixes)})_\\d+$")
+
+    gene_maps = {p: {} for p in prefixes}
+    for alias, string_id in zip(aliases[keep].to_numpy(),
+                                df['string_id'][keep].to_numpy()):
+        for p in prefixes:
+            if alias.startswith(f"{p}_"):
+                # Interning collapses repeated ID strings to one object each
+                gene_maps[p][sys.intern(alias)] = sys.intern(string_id)
+                break
+
+    # Cache the filtered maps so later runs skip the text parse entirely
+    try:
+        with open(cache_file, 'wb') as f:
+            pickle.dump(gene_maps, f, protocol=5)
+    except OSError as e:
+        print(f"  Warning: could not write alias cache ({e})")
+
+    return gene_maps
+
+## Write a mapped table as TSV; plain values stay unquoted as before, but
+## cells carrying tabs or newlines are rewritten with quoting instead of
+## failing and leaving a truncated file behind
+def write_mapped_tsv(table, output_file):
+    for quoting_style in ('none', 'needed'):
+        try:
+            with pa.OSFile(str(output_file), 'wb') as sink:
+                sink.write(b'gene\tstring_id\n')  # Arrow would quote the header
+                pacsv.write_csv(table, sink,
+                                write_options=pacsv.WriteOptions(delimiter='\t',
+                                                                 quoting_style=quoting_style,
+                                                                 include_header=False,
+                                                                 batch_size=65536))
+            return
+        except pa.ArrowInvalid:
+            # A cell contains a structural character; retry with quoting
+            # ('needed' quotes every string in current pyarrow, so it is
+            # only used for these pathological files)
+            continue
 
 ## Read input XLSX files and map gene IDs to STRING Protein IDs
-def process_file(file_path, gene_map):
+def process_file(file_path, alias_table):
     print(f"Processing: {file_path.name}")
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.lower().str.strip()
-        if 'gene' not in df.columns:
+        # Peek at the header row only, then re-read just the gene column so
+        # the other columns are never parsed or allocated
+        header = pd.read_excel(file_path, engine=EXCEL_ENGINE, nrows=0)
+        gene_col = next((c for c in header.columns
+                         if str(c).lower().strip() == 'gene'), None)
+        if gene_col is None:
             print(f"  Skipping: No 'gene' column found in {file_path.name}")
             return None
 
-        df['gene'] = df['gene'].astype(str).str.upper().str.strip()
+        df = pd.read_excel(file_path, engine=EXCEL_ENGINE, usecols=[gene_col])
+        df.columns = ['gene']
+
+        # Arrow-backed strings dispatch strip/upper to native kernels
+        genes = df['gene'].astype('string[pyarrow]').str.strip().str.upper()
+
+        # Map the genes with a vectorized Arrow hash join, deduplicating
+        # first so repeated gene IDs are hashed and joined only once; the
+        # row column restores order since join output is unordered
+        gene_arr = pa.array(genes)
+        if isinstance(gene_arr, pa.ChunkedArray):
+            gene_arr = gene_arr.combine_chunks()  # empty input comes back chunked
+        gene_arr = gene_arr.cast(pa.string())
+        encoded = gene_arr.dictionary_encode()
+        unique_table = pa.table({'gene': encoded.dictionary,
+                                 'row': np.arange(len(encoded.dictionary))})
+        joined = unique_table.join(alias_table, keys='gene',
+                                   join_type='left outer').sort_by('row')
+
+        # Broadcast the per-unique results back to every input row
+        string_ids = joined.column('string_id').take(encoded.indices)
 
-        # Map the genes
-        df['string_id'] = df['gene'].map(gene_map)
-        
         # Calculate stats
-        mapped = df['string_id'].notna().sum()
-        total = len(df)
+        total = len(gene_arr)
+        mapped = total - string_ids.null_count
         percentage = (mapped/total*100) if total > 0 else 0
         print(f"  Mapped {mapped} out of {total} genes ({percentage:.1f}%)")
-        
-        # Save result
+
+        # Save result through Arrow's native CSV writer (nulls become
+        # empty fields, matching the previous to_csv output)
         output_file = OUTPUT_DIR / f"mapped_{file_path.stem}.tsv"
-        df.to_csv(output_file, sep='\t', index=False)
+        write_mapped_tsv(pa.table({'gene': gene_arr, 'string_id': string_ids}),
+                         output_file)
         print(f"  Saved to: {output_file}")
         
         return {'file': file_path.name, 'mapped': mapped, 'total': total}
@@ -79,6 +163,14 @@ def process_file(file_path, gene_map):
         print(f"  Error processing {file_path.name}: {e}")
         return None
 
+## Worker-side setup so each process receives the species lookup only once
+def _init_worker(alias_table):
+    global _ALIAS_TABLE
+    _ALIAS_TABLE = alias_table
+
+def _process_worker(file_path):
+    return process_file(file_path, _ALIAS_TABLE)
+
 
 # Execute the mapping process by looping through species and files
 def main():
@@ -89,28 +181,56 @@ def main():
     
     OUTPUT_DIR.mkdir(exist_ok=True)
     species_stats = {}  # Track stats per species
-    
+
+    # Classify input files once by their leading "<digit>_" pair instead of
+    # regex-testing every file against every species pattern
+    file_buckets = defaultdict(list)
+    for f in sorted(INPUT_DIR.glob("*.xlsx")):
+        file_buckets[f.name[:2]].append(f)
+
+    # Group species by STRING alias file so each file is loaded and
+    # classified once even when several species share a taxid
+    species_by_taxid = defaultdict(list)
     for species, config in SPECIES_CONFIG.items():
-        print(f"--- Starting the mapping for {species} ---")
+        species_by_taxid[config['taxid']].append(species)
 
-        alias_path = STRING_DIR / f"{config['taxid']}.protein.aliases.v{STRING_VERSION}.txt"
+    for taxid, species_group in species_by_taxid.items():
+        alias_path = STRING_DIR / f"{taxid}.protein.aliases.v{STRING_VERSION}.txt"
         if not alias_path.exists():
-            print(f"Error: Alias file not found for {species} ({alias_path})")
+            print(f"Error: Alias file not found for {', '.join(species_group)} ({alias_path})")
             continue
 
-        full_aliases = load_string_aliases(alias_path)
+        gene_maps = load_string_aliases(
+            alias_path, [SPECIES_CONFIG[s]['prefix'] for s in species_group])
 
-        gene_map = filter_gene_map(full_aliases, config['prefix'])
-        print(f"  Filtered to {len(gene_map)} gene IDs with prefix '{config['prefix']}'")
+        for species in species_group:
+            config = SPECIES_CONFIG[species]
+            print(f"--- Starting the mapping for {species} ---")
 
-        species_stats[species] = []  # Initialize list for this species
-        
-        for file_path in INPUT_DIR.glob("*.xlsx"):
-            if re.search(config['file_pattern'], file_path.name):
-                result = process_file(file_path, gene_map)
-                if result:
-                    species_stats[species].append(result)
-        print()
+            gene_map = gene_maps[config['prefix'].upper()]
+            print(f"  Filtered to {len(gene_map)} gene IDs with prefix '{config['prefix']}'")
+
+            # Build the lookup once per species as an Arrow table; every file
+            # then maps through one vectorized hash join against it (typed
+            # explicitly so an empty map still yields joinable columns)
+            alias_table = pa.table({
+                'gene': pa.array(list(gene_map.keys()), type=pa.string()),
+                'string_id': pa.array(list(gene_map.values()), type=pa.string())})
+
+            species_stats[species] = []  # Initialize list for this species
+
+            # Each file is independent, so fan them out across processes
+            # (read_excel is CPU-bound, so threads would not help here)
+            files = [f for digit in config['file_prefixes']
+                     for f in file_buckets[f"{digit}_"]]
+            if files:
+                workers = min(len(files), os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(alias_table,)) as executor:
+                    for result in executor.map(_process_worker, files):
+                        if result:
+                            species_stats[species].append(result)
+            print()
     
     # Print summary by species and total
     if species_stats:
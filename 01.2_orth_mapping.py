@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from pathlib import Path
-import re
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import sys
 
 # Set the base directory with appropriate subfolder structure
 BASE_DIR = Path(".")
@@ -13,7 +19,7 @@ OUTPUT_DIR = BASE_DIR / "mapped_data"     # Where output files will be saved
 # Set specific organisms to map and version of the STRING database
 ORTHOLOG_CONFIG = {
     "F_pseudograminearum_to_F_graminearum": {
-        "file_pattern": "^6_",          # Files starting with "6_" (Study 6)
+        "file_prefixes": "6",           # Leading study digits (Study 6)
         "source_prefix": "FPSE",        # The genes in your Excel file (e.g., FPSE_12345)
         "target_prefix": "FGSG",        # The genes in STRING (e.g., FGSG_12345)
         "target_taxid": "229533",       # Taxonomy ID of the TARGET (F. graminearum)
@@ -21,83 +27,135 @@ ORTHOLOG_CONFIG = {
 }
 STRING_VERSION = "12.0"
 
+# Prefer the Rust-based calamine engine for XLSX parsing; openpyxl is the
+# pure-Python fallback when python-calamine is not installed
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 # Define the necessary functions
 ## Load STRING allias
 def load_target_aliases(alias_file, target_prefix):
-    target_map = {}
     print(f"Loading target aliases from: {alias_file.name}...")
 
-    pattern = re.compile(f"^{target_prefix}_\\d+$", re.IGNORECASE)
-
-    with open(alias_file, 'r') as f:
-        next(f)                           # Skip header
-        for line in f:
-            parts = line.strip().split('\t')
-            if len(parts) >= 2:
-                string_id = parts[0]
-                alias = parts[1].upper()
-                if pattern.match(alias):
-                    target_map[alias] = string_id
+    # Parse with the pandas C engine instead of a per-line Python loop;
+    # STRING alias files carry no quoting, so skip quote handling too
+    df = pd.read_csv(alias_file, sep='\t', header=0, usecols=[0, 1],
+                     names=['string_id', 'alias'], dtype='string', engine='c',
+                     quoting=csv.QUOTE_NONE, memory_map=True)
+    df = df.dropna()                      # Drop malformed rows missing either column
+
+    # Cheap prefix gate first; the regex only runs on the few surviving aliases
+    aliases = df['alias'].str.upper()
+    keep = aliases.str.startswith(f"{target_prefix.upper()}_")
+    df, aliases = df[keep], aliases[keep]
+    keep = aliases.str.match(f"^{target_prefix}_\\d+$", case=False)
+    # Interning collapses repeated ID strings to one object each
+    target_map = {sys.intern(alias): sys.intern(string_id)
+                  for alias, string_id in zip(aliases[keep].to_numpy(),
+                                              df['string_id'][keep].to_numpy())}
 
     print(f"  Found {len(target_map)} valid {target_prefix} genes in STRING database.")
     return target_map
 
 ## Create the orthology mapping from source to target genes
 def create_ortholog_map(target_map, source_prefix, target_prefix):
-    ortholog_map = {}
-
-    # Build regex pattern to extract numeric part
-    target_pattern = re.compile(f"^{target_prefix}_(\\d+)$", re.IGNORECASE)
-    count = 0
-    for target_gene, string_id in target_map.items():
-        match = target_pattern.match(target_gene)
-        if match:
-            number_part = match.group(1)
-            
-            # Construct the corresponding source gene name
-            source_gene = f"{source_prefix}_{number_part}"
-            
-            # Add to map: FPSE_00001 -> STRING_ID_OF_FGSG_00001
-            ortholog_map[source_gene] = string_id
-            count += 1
+    # Keys were already validated as "<target_prefix>_<number>" when loaded,
+    # so a plain slice extracts the numeric part without any regex work
+    plen = len(target_prefix) + 1
 
-    print(f"  Created ortholog map with {count} entries from {source_prefix} to {target_prefix}.")
+    # Add to map: FPSE_00001 -> STRING_ID_OF_FGSG_00001
+    ortholog_map = {f"{source_prefix}_{target_gene[plen:]}": string_id
+                    for target_gene, string_id in target_map.items()}
+
+    print(f"  Created ortholog map with {len(ortholog_map)} entries from {source_prefix} to {target_prefix}.")
     return ortholog_map
 
+## Write a mapped table as TSV; plain values stay unquoted as before, but
+## cells carrying tabs or newlines are rewritten with quoting instead of
+## failing and leaving a truncated file behind
+def write_mapped_tsv(table, output_file):
+    for quoting_style in ('none', 'needed'):
+        try:
+            with pa.OSFile(str(output_file), 'wb') as sink:
+                sink.write(b'gene\tstring_id\n')  # Arrow would quote the header
+                pacsv.write_csv(table, sink,
+                                write_options=pacsv.WriteOptions(delimiter='\t',
+                                                                 quoting_style=quoting_style,
+                                                                 include_header=False,
+                                                                 batch_size=65536))
+            return
+        except pa.ArrowInvalid:
+            # A cell contains a structural character; retry with quoting
+            # ('needed' quotes every string in current pyarrow, so it is
+            # only used for these pathological files)
+            continue
+
 ## Read input XLSX files and apply the orthology mapping
-def process_file(file_path, ortholog_map):
+def process_file(file_path, ortholog_table):
     print(f"Processing: {file_path.name}")
-    
+
     try:
-        df = pd.read_excel(file_path)
-        df.columns = df.columns.str.lower().str.strip()
-        
-        if 'gene' not in df.columns:
+        # Peek at the header row only, then re-read just the gene column so
+        # the other columns are never parsed or allocated
+        header = pd.read_excel(file_path, engine=EXCEL_ENGINE, nrows=0)
+        gene_col = next((c for c in header.columns
+                         if str(c).lower().strip() == 'gene'), None)
+        if gene_col is None:
             print(f"  Skipping: No 'gene' column found in {file_path.name}")
             return None
 
-        df['gene'] = df['gene'].astype(str).str.upper().str.strip()
+        df = pd.read_excel(file_path, engine=EXCEL_ENGINE, usecols=[gene_col])
+        df.columns = ['gene']
+
+        # Arrow-backed strings dispatch strip/upper to native kernels
+        genes = df['gene'].astype('string[pyarrow]').str.strip().str.upper()
+
+        # Map the genes with a vectorized Arrow hash join, deduplicating
+        # first so repeated gene IDs are hashed and joined only once; the
+        # row column restores order since join output is unordered
+        gene_arr = pa.array(genes)
+        if isinstance(gene_arr, pa.ChunkedArray):
+            gene_arr = gene_arr.combine_chunks()  # empty input comes back chunked
+        gene_arr = gene_arr.cast(pa.string())
+        encoded = gene_arr.dictionary_encode()
+        unique_table = pa.table({'gene': encoded.dictionary,
+                                 'row': np.arange(len(encoded.dictionary))})
+        joined = unique_table.join(ortholog_table, keys='gene',
+                                   join_type='left outer').sort_by('row')
+
+        # Broadcast the per-unique results back to every input row
+        string_ids = joined.column('string_id').take(encoded.indices)
 
-        # Map the genes using orthology strategy
-        df['string_id'] = df['gene'].map(ortholog_map)
-        
         # Calculate stats
-        mapped = df['string_id'].notna().sum()
-        total = len(df)
+        total = len(gene_arr)
+        mapped = total - string_ids.null_count
         percentage = (mapped/total*100) if total > 0 else 0
         print(f"  Mapped {mapped} out of {total} genes ({percentage:.1f}%)")
-        
-        # Save result
+
+        # Save result through Arrow's native CSV writer (nulls become
+        # empty fields, matching the previous to_csv output)
         output_file = OUTPUT_DIR / f"mapped_ortholog_{file_path.stem}.tsv"
-        df.to_csv(output_file, sep='\t', index=False)
+        write_mapped_tsv(pa.table({'gene': gene_arr, 'string_id': string_ids}),
+                         output_file)
         print(f"  Saved to: {output_file}")
         
         return {'file': file_path.name, 'mapped': mapped, 'total': total}
-        
+
     except Exception as e:
         print(f"  Error processing {file_path.name}: {e}")
         return None
 
+## Worker-side setup so each process receives the ortholog lookup only once
+def _init_worker(ortholog_table):
+    global _ORTHOLOG_TABLE
+    _ORTHOLOG_TABLE = ortholog_table
+
+def _process_worker(file_path):
+    return process_file(file_path, _ORTHOLOG_TABLE)
+
 
 # Execute the mapping process by looping through species and files
 def main():
@@ -109,7 +167,13 @@ def main():
     print(f"OUTPUT_DIR exists: {OUTPUT_DIR.exists()}\n")
     
     ortholog_stats = {}  # Track stats per ortholog mapping
-    
+
+    # Classify input files once by their leading "<digit>_" pair instead of
+    # regex-testing every file against every mapping pattern
+    file_buckets = {}
+    for f in sorted(INPUT_DIR.glob("*.xlsx")):
+        file_buckets.setdefault(f.name[:2], []).append(f)
+
     for name, config in ORTHOLOG_CONFIG.items():
         print(f"--- Starting Ortholog Mapping: {name} ---")
         
@@ -133,20 +197,29 @@ def main():
         if not final_map:
             print(f"  Error: Ortholog map is empty. Skipping this mapping.")
             continue
-        
+
+        # Build the lookup once per mapping as an Arrow table; every file
+        # then maps through one vectorized hash join against it (typed
+        # explicitly so an empty map still yields joinable columns)
+        ortholog_table = pa.table({
+            'gene': pa.array(list(final_map.keys()), type=pa.string()),
+            'string_id': pa.array(list(final_map.values()), type=pa.string())})
+
         ortholog_stats[name] = []  # Initialize list for this ortholog mapping
-        
-        # 4. Process matching files
-        found_files = False
-        for file_path in INPUT_DIR.glob("*.xlsx"):
-            if re.search(config['file_pattern'], file_path.name):
-                result = process_file(file_path, final_map)
-                if result:
-                    ortholog_stats[name].append(result)
-                    found_files = True
-                
-        if not found_files:
-            print(f"  Warning: No files found matching pattern '{config['file_pattern']}'")
+
+        # 4. Process matching files in parallel; each file is independent
+        # (read_excel is CPU-bound, so threads would not help here)
+        files = [f for digit in config['file_prefixes']
+                 for f in file_buckets.get(f"{digit}_", [])]
+        if files:
+            workers = min(len(files), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(ortholog_table,)) as executor:
+                for result in executor.map(_process_worker, files):
+                    if result:
+                        ortholog_stats[name].append(result)
+        else:
+            print(f"  Warning: No files found starting with '{config['file_prefixes']}'")
         print()
 
     # Print summary by ortholog mapping and total